@@ -1,7 +1,23 @@
+import os
+
 from setuptools import find_packages, setup
 
 __version__ = "0.0.38"
 
+# Optionally compile the prediction constructors with Cython by setting
+# SQUARE_SKILL_API_CYTHONIZE=true. The pure python module is shipped in any case and
+# used if the extension is not available.
+ext_modules = []
+if os.environ.get("SQUARE_SKILL_API_CYTHONIZE", "false").lower() == "true":
+    from Cython.Build import cythonize
+
+    ext_modules = cythonize(
+        ["square_skill_api/models/prediction.py"],
+        language_level=3,
+        # the constructors re-assign annotated arguments, e.g. a `str` with a list
+        compiler_directives={"annotation_typing": False},
+    )
+
 setup(
     name="square_skill_api",
     version=__version__,
@@ -19,6 +35,8 @@ setup(
         "fastapi>=0.65.2",
         "pydantic>=1.8.2",
         "numpy>=1.21.3",
+        "orjson>=3.6.0",
         "square-elk-json-formatter==0.0.3",
     ],
+    ext_modules=ext_modules,
 )
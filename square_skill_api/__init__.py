@@ -34,8 +34,12 @@ def get_app(
     fast_app.add_event_handler("startup", start_app_handler(fast_app))
     fast_app.add_event_handler("shutdown", stop_app_handler(fast_app))
 
+    # async, so FastAPI resolves the dependency without a threadpool round-trip
+    async def get_predict_fn() -> Callable:
+        return predict_fn
+
     fast_app.dependency_overrides[
         square_skill_api.api.routes.query.predict
-    ] = lambda: predict_fn
+    ] = get_predict_fn
 
     return fast_app
@@ -1,6 +1,7 @@
 import logging
 
 from fastapi import APIRouter, Depends
+from fastapi.responses import ORJSONResponse
 
 from square_skill_api.models import QueryOutput, QueryRequest
 
@@ -9,7 +10,7 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
-def predict():
+async def predict():
     """Placeholder function, to be overwritten by the Skill implementation."""
 
     def predict_fn():
@@ -20,13 +21,24 @@ def predict():
 
 @router.post(
     "/query",
-    response_model=QueryOutput,
+    # documenting QueryOutput via `responses` instead of `response_model` keeps
+    # FastAPI from cloning the whole QueryOutput model tree for this route
+    response_model=None,
+    responses={200: {"model": QueryOutput}},
+    response_class=ORJSONResponse,
     name="Skill Query",
 )
-async def query(query: QueryRequest, predict_fn=Depends(predict)) -> QueryOutput:
+async def query(query: QueryRequest, predict_fn=Depends(predict)) -> ORJSONResponse:
     """Query a skill by providing an input (e.g. question and optional context) and
     receiving a prediction (e.g. an answer to a question)."""
-    logger.info(f"Query: {query.dict()}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Query: %s", query.dict())
     prediction = await predict_fn(query)
 
-    return prediction
+    # an already created QueryOutput is returned without re-validating it
+    if not isinstance(prediction, QueryOutput):
+        prediction = QueryOutput.parse_obj(prediction)
+
+    # unset optionals (e.g. attributions, prediction_graph) are left out of the
+    # response instead of being sent as null
+    return ORJSONResponse(prediction.dict(exclude_none=True))
@@ -1,7 +1,8 @@
 import logging
+import os
 from collections.abc import Iterable as cIterable
-from itertools import zip_longest
-from typing import Dict, Iterable, List, Optional, Tuple, Union
+from functools import singledispatch
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Type, Union
 
 import numpy as np
 from pydantic import BaseModel, Field, root_validator
@@ -10,6 +11,30 @@ logger = logging.getLogger(__name__)
 
 NO_ANSWER_FOUND_STRING = "No answer found."
 
+# The model api output is trusted, hence predictions are created without running the
+# pydantic validators. Set VALIDATE_QUERY_OUTPUT=true to validate them anyway, e.g.
+# when the models are extended with custom validators.
+_VALIDATE_QUERY_OUTPUT = (
+    os.environ.get("VALIDATE_QUERY_OUTPUT", "false").lower() == "true"
+)
+
+
+def _construct(model: Type[BaseModel], **kwargs) -> BaseModel:
+    """Creates an instance of `model`. Validation is skipped unless
+    `VALIDATE_QUERY_OUTPUT` is set."""
+    if _VALIDATE_QUERY_OUTPUT:
+        return model(**kwargs)
+    return model.construct(**kwargs)
+
+
+def _constructors(*models: Type[BaseModel]) -> Tuple[Callable[..., BaseModel], ...]:
+    """Returns the constructor of each of `models`, skipping validation like
+    `_construct`. Binding them to locals once keeps global and attribute lookups out
+    of the loops creating the predictions."""
+    if _VALIDATE_QUERY_OUTPUT:
+        return models
+    return tuple(model.construct for model in models)
+
 
 class PredictionOutput(BaseModel):
     """Holds the output (e.g. an answer) and the score of that output."""
@@ -21,6 +46,9 @@ class PredictionOutput(BaseModel):
     )
     output_score: float = Field(..., description="The score assigned to the output.")
 
+    class Config:
+        allow_mutation = False
+
 
 class PredictionDocument(BaseModel):
     """Holds a Document a prediction is based on."""
@@ -39,6 +67,9 @@ class PredictionDocument(BaseModel):
         0, description="The score assigned to the document by retrieval"
     )
 
+    class Config:
+        allow_mutation = False
+
 
 class Node(BaseModel):
     id: int
@@ -47,6 +78,9 @@ class Node(BaseModel):
     ans_node: bool
     weight: float
 
+    class Config:
+        allow_mutation = False
+
 
 class Edge(BaseModel):
     source: int
@@ -54,6 +88,9 @@ class Edge(BaseModel):
     weight: float
     label: str
 
+    class Config:
+        allow_mutation = False
+
 
 class SubGraph(BaseModel):
     nodes: Dict[str, Node]
@@ -108,6 +145,54 @@ class Prediction(BaseModel):
     )
 
 
+_NO_ANSWER = frozenset(("", NO_ANSWER_FOUND_STRING))
+
+
+@singledispatch
+def _sort_key(p) -> Tuple:
+    """Returns the key for sorting a prediction. Further prediction types can be
+    supported via `_sort_key.register`."""
+    raise TypeError(type(p))
+
+
+@_sort_key.register(Prediction)
+def _key_from_obj(p: Prediction) -> Tuple:
+    document_score = 1
+    if p.prediction_documents:
+        document_score = p.prediction_documents[0].document_score
+    return (
+        p.prediction_output.output not in _NO_ANSWER,
+        p.prediction_score,
+        document_score,
+    )
+
+
+@_sort_key.register(dict)
+def _key_from_dict(p: Dict) -> Tuple:
+    document_score = 1
+    if p["prediction_documents"]:
+        document_score = p["prediction_documents"][0]["document_score"]
+    return (
+        p["prediction_output"]["output"] not in _NO_ANSWER,
+        p["prediction_score"],
+        document_score,
+    )
+
+
+def _sort_predictions(predictions: List[Union[Prediction, Dict]]) -> None:
+    """Sorts predictions in place (descending). The key function is chosen once by
+    the type of the first prediction."""
+    if len(predictions) <= 1:
+        return
+    key = _sort_key.dispatch(type(predictions[0]))
+    keys = [key(p) for p in predictions]
+    # predictions from the model api are often already sorted
+    if all(k >= k_next for k, k_next in zip(keys, keys[1:])):
+        return
+    order = sorted(range(len(keys)), key=keys.__getitem__, reverse=True)
+    predictions[:] = [predictions[i] for i in order]
+
+
 class QueryOutput(BaseModel):
     """The model for output that the skill returns after processing a query."""
 
@@ -120,26 +205,7 @@ class QueryOutput(BaseModel):
     @staticmethod
     def sort_predictions_key(p: Union[Prediction, Dict]) -> Tuple:
         """Returns a key for soring predictions."""
-        document_score = 1
-        if isinstance(p, Prediction):
-            answer_found = p.prediction_output.output not in [
-                "",
-                NO_ANSWER_FOUND_STRING,
-            ]
-            answer_score = p.prediction_score
-            if p.prediction_documents:
-                document_score = getattr(p.prediction_documents[0], "document_score", 1)
-        elif isinstance(p, Dict):
-            answer_found = p["prediction_output"]["output"] not in [
-                "",
-                NO_ANSWER_FOUND_STRING,
-            ]
-            answer_score = p["prediction_score"]
-            if p["prediction_documents"]:
-                document_score = p["prediction_documents"][0].get("document_score", 1)
-        else:
-            raise TypeError(type(p))
-        return (answer_found, answer_score, document_score)
+        return _sort_key(p)
 
     @staticmethod
     def overwrite_from_model_api_output(
@@ -162,12 +228,12 @@ class QueryOutput(BaseModel):
         attributions: List[Dict[str, List[List[int]]]], index
     ) -> Attributions:
 
-        attribution_keys = attributions[0].keys()
-        context_attributions = {}
-        for k in attribution_keys:
-            context_attributions[k] = attributions[0][k][index]
-
-        return Attributions.parse_obj(context_attributions)
+        # like parse_obj, ignore keys that are not fields of Attributions
+        fields = Attributions.__fields__
+        return _construct(
+            Attributions,
+            **{k: v[index] for k, v in attributions[0].items() if k in fields},
+        )
 
     @root_validator
     def sort_predictions(cls, values):
@@ -182,12 +248,33 @@ class QueryOutput(BaseModel):
         """
 
         if values["adversarial"] is None:
-            values["predictions"] = sorted(
-                values["predictions"], key=cls.sort_predictions_key, reverse=True
-            )
+            _sort_predictions(values["predictions"])
 
         return values
 
+    @classmethod
+    def _from_predictions(
+        cls, predictions: List[Prediction], adversarial: Union[None, Dict] = None
+    ):
+        """Creates the QueryOutput from already constructed predictions. Unless
+        `VALIDATE_QUERY_OUTPUT` is set, validation is skipped and the predictions are
+        sorted here instead of in `sort_predictions`.
+
+        Args:
+            predictions (List[Prediction]): List of unsorted predictions
+            adversarial (Union[None, Dict], optional): Adversarial output of the model
+            api. If given, the predictions are not sorted. Defaults to None.
+        """
+        if _VALIDATE_QUERY_OUTPUT:
+            return cls(predictions=predictions, adversarial=adversarial)
+
+        if adversarial is None:
+            _sort_predictions(predictions)
+        else:
+            adversarial = Adversarial.parse_obj(adversarial)
+
+        return cls.construct(predictions=predictions, adversarial=adversarial)
+
     @classmethod
     def from_sequence_classification(
         cls,
@@ -204,6 +291,9 @@ class QueryOutput(BaseModel):
             context (Union[None, str, List[str]], optional): Context used to obtain
             model api output. Defaults to None.
         """
+        new_prediction, new_output, new_document = _constructors(
+            Prediction, PredictionOutput, PredictionDocument
+        )
 
         is_attack = len(model_api_output.get("adversarial", [])) > 0
         model_api_logits = model_api_output["model_outputs"]["logits"]
@@ -212,33 +302,61 @@ class QueryOutput(BaseModel):
         if len(model_api_logits) > 1:
             # for categorical skills when using attack method logits are 2d
             logits = model_api_logits
+            top_answer_idxs = None
+            if all(isinstance(row, cIterable) for row in logits) and (
+                len({len(row) for row in logits}) == 1
+            ):
+                # top answer of each row, computed in a single pass over the 2d logits
+                top_answer_idxs = np.argmax(logits, axis=-1).tolist()
+            # flat or ragged logits are handled row by row below
         else:
             logits = model_api_logits[0]
             top_answer_idx = np.argmax(logits)
+            top_answer_idxs = None
+        n = len(logits)
 
         questions = cls.overwrite_from_model_api_output(
             model_api_output,
             key="questions",
             value=questions,
-            extend_to_len=len(logits),
+            extend_to_len=n,
         )
         context = cls.overwrite_from_model_api_output(
             model_api_output,
             key="contexts",
             value=context,
-            extend_to_len=len(logits),
+            extend_to_len=n,
         )
 
-        logger.info(f"is_attack={is_attack}")
-        logger.info(f"questions={questions}")
-        logger.info(f"context={context}")
-        logger.info(f"attributions={attributions}")
-        logger.info(f"logits={logits}")
-        logger.info(f"answers={answers}")
+        logger.info("is_attack=%s", is_attack)
+        logger.info("questions=%s", questions)
+        logger.info("context=%s", context)
+        logger.info("attributions=%s", attributions)
+        logger.info("logits=%s", logits)
+        logger.info("answers=%s", answers)
+
+        if len(questions) < n or len(context) < n:
+            raise ValueError(
+                f"Expected {n} questions and contexts, one per logit, "
+                f"got {len(questions)} questions and {len(context)} contexts."
+            )
+        # attributions are either given for all answers or only for the top answer
+        top_answer_attributions_only = (
+            bool(attributions) and len(attributions[0]["topk_question_idx"]) == 1
+        )
 
+        # identical contexts (e.g. a single context str for all answers) share one
+        # PredictionDocument
+        context_documents: Dict[str, PredictionDocument] = {}
         predictions = []
-        for i, answer_score in enumerate(logits):
-            if isinstance(answer_score, cIterable):
+        for i, (question, answer_score, document) in enumerate(
+            zip(questions, logits, context)
+        ):
+            if top_answer_idxs is not None:
+                top_answer_idx = top_answer_idxs[i]
+                answer_score = answer_score[top_answer_idx]
+                answer = answers[top_answer_idx]
+            elif isinstance(answer_score, cIterable):
                 top_answer_idx = np.argmax(answer_score)
                 answer_score = answer_score[top_answer_idx]
                 answer = answers[top_answer_idx]
@@ -247,37 +365,36 @@ class QueryOutput(BaseModel):
             else:
                 answer = answers[i]
 
-            prediction_output = PredictionOutput(
-                output=answer, output_score=answer_score
-            )
-            prediction = Prediction(
-                question=questions[i],
+            prediction_document = context_documents.get(document)
+            if prediction_document is None:
+                prediction_document = context_documents[document] = new_document(
+                    document=document
+                )
+            prediction_output = new_output(output=answer, output_score=answer_score)
+            prediction = new_prediction(
+                question=question,
                 prediction_score=answer_score,
                 prediction_output=prediction_output,
-                prediction_documents=[PredictionDocument(document=context[i])],
+                prediction_documents=[prediction_document],
             )
-            if attributions:
-                if len(attributions[0]["topk_question_idx"]) == 1:
-                    # attributions only for top_answer
-                    if i == top_answer_idx:
-                        index = 0
-                    else:
-                        continue
-                else:
-                    # attributions for all answers
-                    index = i
+            if top_answer_attributions_only:
+                if i == top_answer_idx:
+                    prediction.attributions = cls.get_attribution_by_index(
+                        attributions, index=0
+                    )
+            elif attributions:
                 prediction.attributions = cls.get_attribution_by_index(
-                    attributions, index=index
+                    attributions, index=i
                 )
 
             predictions.append(prediction)
 
         if is_attack:
-            predictions = cls(
-                predictions=predictions, adversarial=model_api_output["adversarial"]
+            predictions = cls._from_predictions(
+                predictions, adversarial=model_api_output["adversarial"]
             )
         else:
-            predictions = cls(predictions=predictions)
+            predictions = cls._from_predictions(predictions)
 
         return predictions
 
@@ -288,28 +405,28 @@ class QueryOutput(BaseModel):
         answers: List[str],
         model_api_output: Dict,
     ):
+        new_prediction, new_output = _constructors(Prediction, PredictionOutput)
+        predictions_scores = model_api_output["model_outputs"]["logits"][0]
+        predicted_label = model_api_output["labels"][0]
 
         questions = cls.overwrite_from_model_api_output(
             model_api_output,
             key="questions",
             value=questions,
-            extend_to_len=len(model_api_output["model_outputs"]["logits"][0]),
+            extend_to_len=len(predictions_scores),
         )
         predictions = []
-        predictions_scores = model_api_output["model_outputs"]["logits"][0]
         for i, (question, prediction_score, answer) in enumerate(
             zip(questions, predictions_scores, answers)
         ):
-            prediction_output = PredictionOutput(
-                output=answer, output_score=prediction_score
-            )
-            prediction = Prediction(
+            prediction_output = new_output(output=answer, output_score=prediction_score)
+            prediction = new_prediction(
                 question=question,
                 prediction_score=prediction_score,
                 prediction_output=prediction_output,
             )
 
-            if i == model_api_output["labels"][0]:
+            if i == predicted_label:
                 # add subgraphs to the predicted answer
                 prediction_graph = PredictionGraph(
                     lm_subgraph=model_api_output["lm_subgraph"],
@@ -319,7 +436,7 @@ class QueryOutput(BaseModel):
 
             predictions.append(prediction)
 
-        return cls(predictions=predictions)
+        return cls._from_predictions(predictions)
 
     @classmethod
     def from_question_answering(
@@ -338,21 +455,28 @@ class QueryOutput(BaseModel):
             context_score (Union[None, float, List[float]], optional): Context scores
             from datastores.
         """
-        logger.debug(f"input questions: {questions}")
-        logger.debug(f"input context: {context}")
+        new_prediction, new_output, new_document = _constructors(
+            Prediction, PredictionOutput, PredictionDocument
+        )
+
+        logger.debug("input questions: %s", questions)
+        logger.debug("input context: %s", context)
+
+        answers_per_context = model_api_output["answers"]
+        n_contexts = len(answers_per_context)
 
         questions = cls.overwrite_from_model_api_output(
             model_api_output,
             value=questions,
             key="questions",
-            extend_to_len=len(model_api_output["answers"]),
+            extend_to_len=n_contexts,
         )
 
         context = cls.overwrite_from_model_api_output(
             model_api_output,
             value=context,
             key="contexts",
-            extend_to_len=len(model_api_output["answers"]),
+            extend_to_len=n_contexts,
         )
 
         # TODO: make this work with the datastore api output to support all
@@ -360,47 +484,51 @@ class QueryOutput(BaseModel):
         predictions: List[Prediction] = []
 
         attributions = model_api_output.get("attributions", None)
-        logger.info(f"attributions: {attributions}")
-        logger.info(f"questions: {questions}")
-        logger.info(f"context: {context}")
-        logger.info(f"answers: {model_api_output['answers']}")
+        logger.info("attributions: %s", attributions)
+        logger.info("questions: %s", questions)
+        logger.info("context: %s", context)
+        logger.info("answers: %s", answers_per_context)
         # loop over contexts
         for i_context, (question, document, answers) in enumerate(
-            zip(questions, context, model_api_output["answers"])
+            zip(questions, context, answers_per_context)
         ):
             if isinstance(context_score, list):
                 document_score = context_score[i_context]
             elif isinstance(context_score, float):
                 document_score = context_score
             else:
-                document_score = 1
+                document_score = 1.0
+            # the document and its score are the same for all answers of a context,
+            # only the span is set per answer. copy() does not validate, hence the
+            # template is only used when validation is skipped anyway.
+            document_template = None
+            if not _VALIDATE_QUERY_OUTPUT:
+                document_template = new_document(
+                    document=document, document_score=document_score
+                )
             # get the sorted attributions for the answers from one doc
-            scores = [answer["score"] for answer in answers]
-            top_answer_idx = np.argmax(scores)
+            top_answer_idx = max(range(len(answers)), key=lambda i: answers[i]["score"])
 
             # loop over answers per doc
-            for i_answer, (answer, prediction_score) in enumerate(
-                zip(
-                    answers,
-                    scores,
-                )
-            ):
+            for i_answer, answer in enumerate(answers):
+                prediction_score = answer["score"]
                 answer_str = answer["answer"]
                 if not answer_str:
                     answer_str = NO_ANSWER_FOUND_STRING
 
-                prediction_output = PredictionOutput(
+                prediction_output = new_output(
                     output=answer_str, output_score=prediction_score
                 )
                 # NOTE: currently only one document per answer is supported
-                prediction_documents = [
-                    PredictionDocument(
-                        document=document,
-                        span=[answer["start"], answer["end"]],
-                        document_score=document_score,
+                span = [answer["start"], answer["end"]]
+                if document_template is None:
+                    prediction_document = new_document(
+                        document=document, span=span, document_score=document_score
                     )
-                ]
-                prediction = Prediction(
+                else:
+                    prediction_document = document_template.copy(update={"span": span})
+                prediction_documents = [prediction_document]
+                prediction = new_prediction(
                     question=question,
                     prediction_score=prediction_score,
                     prediction_output=prediction_output,
@@ -410,15 +538,15 @@ class QueryOutput(BaseModel):
                     prediction.attributions = cls.get_attribution_by_index(
                         attributions, index=i_context
                     )
-                logger.debug(f"prediction: {prediction}")
+                logger.debug("prediction: %s", prediction)
                 predictions.append(prediction)
 
         if "adversarial" in model_api_output:
-            predictions = cls(
-                predictions=predictions, adversarial=model_api_output["adversarial"]
+            predictions = cls._from_predictions(
+                predictions, adversarial=model_api_output["adversarial"]
             )
         else:
-            predictions = cls(predictions=predictions)
+            predictions = cls._from_predictions(predictions)
 
         return predictions
 
@@ -436,14 +564,15 @@ class QueryOutput(BaseModel):
             context (Union[None, str, List[str]]): Context used to obtain model api output.
             context_score (Union[None, float, List[float]]): Context scores from datastores.
         """
+        new_prediction, new_output = _constructors(Prediction, PredictionOutput)
 
         if isinstance(questions, str) and isinstance(context, list):
             questions = [questions] * len(context)
 
         predictions: List[Prediction] = []
 
-        logger.info(f"questions: {questions}")
-        logger.info(f"context: {context}")
+        logger.info("questions: %s", questions)
+        logger.info("context: %s", context)
 
         # loop over contexts, and add each document as the entire prediction
         for i_context, (question, document) in enumerate(zip(questions, context)):
@@ -452,24 +581,22 @@ class QueryOutput(BaseModel):
             elif isinstance(context_score, float):
                 document_score = context_score
             else:
-                document_score = 1
+                document_score = 1.0
 
             # prediction output is usually the answer from the qa-model
             # but in this case we're outputting the retrieved document
-            prediction_output = PredictionOutput(
-                output=document, output_score=document_score
-            )
+            prediction_output = new_output(output=document, output_score=document_score)
 
-            prediction = Prediction(
+            prediction = new_prediction(
                 question=question,
                 prediction_score=document_score,
                 prediction_output=prediction_output,
             )
 
-            logger.debug(f"prediction: {prediction}")
+            logger.debug("prediction: %s", prediction)
             predictions.append(prediction)
 
-        predictions = cls(predictions=predictions)
+        predictions = cls._from_predictions(predictions)
 
         return predictions
 
@@ -490,6 +617,10 @@ class QueryOutput(BaseModel):
             context_score (Union[None, float, List[float]], optional): Context scores
             from datastores.
         """
+        new_prediction, new_output, new_document = _constructors(
+            Prediction, PredictionOutput, PredictionDocument
+        )
+
         # questions = cls.overwrite_from_model_api_output(
         #     questions,
         #     model_api_output,
@@ -501,25 +632,38 @@ class QueryOutput(BaseModel):
             key="questions",
             extend_to_len=len(model_api_output["answers"]),
         )
+        generated_texts = model_api_output["generated_texts"][0]
+        n = len(generated_texts)
+        # attributions are optional, pad them to align with the generated texts
+        all_attributions = model_api_output.get("attributions")
+        if not all_attributions:
+            all_attributions = (None,) * n
+        else:
+            all_attributions = list(all_attributions)
+            all_attributions.extend([None] * (n - len(all_attributions)))
+        if len(questions) < n:
+            raise ValueError(
+                f"Expected {n} questions, one per generated text, "
+                f"got {len(questions)}."
+            )
+        # the context is the same for all generated texts
+        prediction_document = new_document(document=context)
 
         predictions: List[Prediction] = []
-        for question, answer, attributions in zip_longest(
-            questions,
-            model_api_output["generated_texts"][0],
-            model_api_output.get("attributions", []),
-            fillvalue=None,
+        for question, answer, attributions in zip(
+            questions, generated_texts, all_attributions
         ):
             # output_score is None for now
-            prediction_output = PredictionOutput(output=answer, output_score=1)
-            prediction = Prediction(
+            prediction_output = new_output(output=answer, output_score=1.0)
+            prediction = new_prediction(
                 question=question,
-                prediction_score=1,
+                prediction_score=1.0,
                 prediction_output=prediction_output,
-                prediction_documents=[PredictionDocument(document=context)],
+                prediction_documents=[prediction_document],
             )
             if attributions:
                 prediction.attributions = attributions
 
             predictions.append(prediction)
 
-        return cls(predictions=predictions)
+        return cls._from_predictions(predictions)
@@ -0,0 +1,30 @@
+from fastapi.testclient import TestClient
+
+from square_skill_api import get_app
+from square_skill_api.models import QueryOutput
+
+
+def test_query(model_api_question_answering_output_factory):
+    model_api_output = model_api_question_answering_output_factory(
+        n_docs=1, n_answers=3
+    )
+
+    async def predict(request):
+        return QueryOutput.from_question_answering(
+            questions=request.query,
+            model_api_output=model_api_output,
+            context="document",
+        )
+
+    client = TestClient(get_app(predict_fn=predict))
+    response = client.post("/query", json={"query": "test question"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    predictions = response.json()["predictions"]
+    assert len(predictions) == 3
+    assert all(p["question"] == "test question" for p in predictions)
+    assert all("attributions" not in p for p in predictions)
+    assert predictions[0]["prediction_score"] == max(
+        p["prediction_score"] for p in predictions
+    )
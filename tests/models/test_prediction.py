@@ -1,9 +1,12 @@
 import itertools
 
 import pytest
+from pydantic import ValidationError
 
+from square_skill_api.models import prediction
 from square_skill_api.models.prediction import (
     NO_ANSWER_FOUND_STRING,
+    Prediction,
     PredictionDocument,
     QueryOutput,
     NO_ANSWER_FOUND_STRING,
@@ -105,6 +108,7 @@ def test_query_output_with_attributions_sorting(
         model_api_output=model_api_output,
         context=None,
     )
+    assert len(query_output.predictions) == n
     assert query_output.predictions[0].attributions is not None
     assert all(p.attributions is None for p in query_output.predictions[1:])
 
@@ -174,3 +178,161 @@ def test_query_output_from_question_answering(
             assert query_output.predictions[-1].prediction_documents[
                 0
             ].document_score == min(context_score)
+
+
+def test_query_output_without_validation_equals_validated(
+    monkeypatch,
+    model_api_question_answering_output_factory,
+):
+    model_api_output = model_api_question_answering_output_factory(
+        n_docs=2, n_answers=3
+    )
+    query_output = QueryOutput.from_question_answering(
+        questions="test question",
+        model_api_output=model_api_output,
+        context=["documentA", "documentB"],
+        context_score=[0.7, 0.3],
+    )
+
+    monkeypatch.setattr(prediction, "_VALIDATE_QUERY_OUTPUT", True)
+    validated_query_output = QueryOutput.from_question_answering(
+        questions="test question",
+        model_api_output=model_api_output,
+        context=["documentA", "documentB"],
+        context_score=[0.7, 0.3],
+    )
+
+    assert query_output.dict() == validated_query_output.dict()
+
+
+def test_query_output_validates_span(
+    monkeypatch,
+    model_api_question_answering_output_factory,
+):
+    model_api_output = model_api_question_answering_output_factory(
+        n_docs=1, n_answers=3
+    )
+    model_api_output["answers"][0][0]["start"] = "x"
+    model_api_output["answers"][0][0]["end"] = None
+
+    monkeypatch.setattr(prediction, "_VALIDATE_QUERY_OUTPUT", True)
+    with pytest.raises(ValidationError):
+        QueryOutput.from_question_answering(
+            questions="test question",
+            model_api_output=model_api_output,
+            context="document",
+        )
+
+
+def test_query_output_from_sequence_classification_2d_logits():
+    answers = ["yes", "no"]
+    model_api_output = {
+        "model_outputs": {"logits": [[0.1, 0.9], [0.8, 0.2], [0.3, 0.7]]},
+        "adversarial": {"indices": [1]},
+    }
+    query_output = QueryOutput.from_sequence_classification(
+        questions="test question",
+        answers=answers,
+        model_api_output=model_api_output,
+    )
+
+    # predictions of an attack are not sorted
+    assert [p.prediction_output.output for p in query_output.predictions] == [
+        "no",
+        "yes",
+        "no",
+    ]
+    assert [p.prediction_score for p in query_output.predictions] == [0.9, 0.8, 0.7]
+    assert query_output.adversarial.indices == [1]
+
+
+def test_shared_prediction_document_is_immutable(
+    model_api_sequence_classification_ouput_factory,
+):
+    query_output = QueryOutput.from_sequence_classification(
+        questions="test question",
+        answers=["door 0", "door 1"],
+        model_api_output=model_api_sequence_classification_ouput_factory(n=2),
+        context="document",
+    )
+    document = query_output.predictions[0].prediction_documents[0]
+    assert document is query_output.predictions[1].prediction_documents[0]
+    with pytest.raises(TypeError):
+        document.document_score = 1.0
+
+
+def test_query_output_documents_have_document_score(
+    model_api_sequence_classification_ouput_factory,
+    model_api_question_answering_output_factory,
+):
+    query_outputs = [
+        QueryOutput.from_sequence_classification(
+            questions="test question",
+            answers=["door 0", "door 1"],
+            model_api_output=model_api_sequence_classification_ouput_factory(n=2),
+        ),
+        QueryOutput.from_question_answering(
+            questions="test question",
+            model_api_output=model_api_question_answering_output_factory(
+                n_docs=1, n_answers=3
+            ),
+        ),
+        QueryOutput.from_generation(
+            questions="test question",
+            model_api_output={"answers": ["a"], "generated_texts": [["answer"]]},
+        ),
+    ]
+    for query_output in query_outputs:
+        # the dict sort key relies on document_score always being present
+        for p in query_output.dict()["predictions"]:
+            assert all("document_score" in d for d in p["prediction_documents"])
+            assert QueryOutput.sort_predictions_key(p) == (
+                QueryOutput.sort_predictions_key(Prediction.parse_obj(p))
+            )
+
+
+def test_query_output_from_sequence_classification_context_lengths(
+    model_api_sequence_classification_ouput_factory,
+):
+    answers = ["door 0", "door 1", "door 2"]
+    model_api_output = model_api_sequence_classification_ouput_factory(n=3)
+
+    # additional contexts are ignored
+    query_output = QueryOutput.from_sequence_classification(
+        questions="test question",
+        answers=answers,
+        model_api_output=model_api_output,
+        context=["x", "y", "x", "z"],
+    )
+    assert len(query_output.predictions) == 3
+
+    with pytest.raises(ValueError):
+        QueryOutput.from_sequence_classification(
+            questions="test question",
+            answers=answers,
+            model_api_output=model_api_output,
+            context=["x", "y"],
+        )
+
+
+@pytest.mark.parametrize(
+    "logits,expected_outputs,expected_scores",
+    [
+        ([0.1, 0.9], ["no", "yes"], [0.9, 0.1]),
+        ([[0.1, 0.9], [0.2, 0.3, 0.5]], ["no", "maybe"], [0.9, 0.5]),
+    ],
+    ids=["flat", "ragged"],
+)
+def test_query_output_from_sequence_classification_non_rectangular_logits(
+    logits, expected_outputs, expected_scores
+):
+    query_output = QueryOutput.from_sequence_classification(
+        questions="test question",
+        answers=["yes", "no", "maybe"],
+        model_api_output={"model_outputs": {"logits": logits}},
+    )
+
+    assert [
+        p.prediction_output.output for p in query_output.predictions
+    ] == expected_outputs
+    assert [p.prediction_score for p in query_output.predictions] == expected_scores